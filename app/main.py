@@ -1,12 +1,37 @@
+import os
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+
 import requests
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 
 from . import utils
 from .routers import auth, ranking, admin, stats
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # run once per worker at startup rather than on every import of the module
+    await run_in_threadpool(init_db)
+    yield
+    utils.close_connections()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# uploads may replace a file under the same name, so cache for a day rather
+# than marking media immutable; StaticFiles' ETag handles revalidation
+MEDIA_CACHE_CONTROL = "public, max-age=86400"
+
+
+class MediaFiles(StaticFiles):
+    def file_response(self, *args, **kwargs) -> Response:
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = MEDIA_CACHE_CONTROL
+        return response
+
 
 # expose key globals for tests
 MEDIA_DIR = utils.MEDIA_DIR
@@ -17,6 +42,7 @@ BUILD_NUMBER = utils.BUILD_NUMBER
 NUM_MEDIA = utils.NUM_MEDIA
 serializer = utils.serializer
 
+# copied into utils once, when the database is initialised, rather than on every call
 def sync_config() -> None:
     utils.MEDIA_DIR = MEDIA_DIR
     utils.CONFIG_DIR = CONFIG_DIR
@@ -29,88 +55,88 @@ def init_db() -> None:
     utils.init_db()
 
 def is_admin(username: str | None) -> bool:
-    sync_config()
     return utils.is_admin(username)
 
 def hash_password(password: str) -> str:
     return utils.hash_password(password)
 
 def get_username(request):
-    sync_config()
     return utils.get_username(request)
 
 def verify_user(username: str, password: str) -> bool:
-    sync_config()
     return utils.verify_user(username, password)
 
+def create_user(username: str, password: str) -> bool:
+    return utils.create_user(username, password)
+
 def list_users() -> list[str]:
-    sync_config()
     return utils.list_users()
 
 def get_media_file_summary():
-    sync_config()
     return utils.get_media_file_summary()
 
 def get_media_files(username: str, count: int):
-    sync_config()
     return utils.get_media_files(username, count)
 
+def record_ranking(username: str, files: list[str]) -> None:
+    utils.record_ranking(username, files)
+
 def change_user_password(username: str, new_password: str) -> None:
-    sync_config()
     utils.change_user_password(username, new_password)
 
 def get_user_rating_counts():
-    sync_config()
     return utils.get_user_rating_counts()
 
 def get_rating_event_count() -> int:
-    sync_config()
     return utils.get_rating_event_count()
 
 def load_ollama_config():
-    sync_config()
     return utils.load_ollama_config()
 
 def save_ollama_config(url: str, api_key: str, model: str) -> None:
-    sync_config()
     utils.save_ollama_config(url, api_key, model)
 
 def generate_all_embeddings(url: str, api_key: str, model: str) -> int:
-    sync_config()
     return utils.generate_all_embeddings(url, api_key, model)
 
 def delete_user(username: str) -> None:
-    sync_config()
     utils.delete_user(username)
 
 def get_user_media_stats(username: str, limit: int = 5):
-    sync_config()
     return utils.get_user_media_stats(username, limit)
 
 def get_global_media_stats_with_user(username: str, limit: int = 5):
-    sync_config()
     return utils.get_global_media_stats_with_user(username, limit)
 
 def get_elo_rankings(limit: int = 20):
-    sync_config()
     return utils.get_elo_rankings(limit)
 
 def get_name_group_elo_stats():
-    sync_config()
     return utils.get_name_group_elo_stats()
 
 def remove_duplicate_images() -> int:
-    sync_config()
     return utils.remove_duplicate_images()
 
+def media_redirect_response(filename: str, prefix: str) -> Response:
+    """Hand ``filename`` off to the nginx location ``prefix`` via X-Accel-Redirect."""
+    if os.path.basename(filename) != filename or filename in ("", ".", ".."):
+        raise HTTPException(status_code=404)
+    location = prefix.rstrip("/") + "/" + quote(filename)
+    return Response(
+        headers={"X-Accel-Redirect": location, "Cache-Control": MEDIA_CACHE_CONTROL}
+    )
+
+
 # mount static and media
-app.mount("/media", StaticFiles(directory=MEDIA_DIR), name="media")
+if utils.MEDIA_ACCEL_REDIRECT:
+    @app.api_route("/media/{filename}", methods=["GET", "HEAD"])
+    async def media_file(filename: str):
+        return media_redirect_response(filename, utils.MEDIA_ACCEL_REDIRECT)
+else:
+    app.mount("/media", MediaFiles(directory=MEDIA_DIR), name="media")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-templates = Jinja2Templates(directory="app/templates")
-
-# initialize DB
-init_db()
+templates = utils.templates
 
 # include routers
 app.include_router(ranking.router)
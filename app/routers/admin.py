@@ -1,27 +1,33 @@
 import os
-import sqlite3
+import shutil
 from fastapi import APIRouter, Request, Form, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
 
 from .. import utils
 
 router = APIRouter()
 
-templates = Jinja2Templates(directory="app/templates")
+templates = utils.templates
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+def save_upload(src, file_path: str) -> None:
+    with open(file_path, "wb") as out:
+        shutil.copyfileobj(src, out, UPLOAD_CHUNK_SIZE)
 
 @router.get("/admin", response_class=HTMLResponse)
-def admin_panel(request: Request):
+async def admin_panel(request: Request):
     username = utils.get_username(request)
     if not utils.is_admin(username):
         return RedirectResponse("/login")
-    users = utils.list_users()
-    rating_counts = utils.get_user_rating_counts()
-    media_total, media_counts = utils.get_media_file_summary()
-    ollama_url, ollama_api_key, ollama_model = utils.load_ollama_config()
+    users = await run_in_threadpool(utils.list_users)
+    rating_counts = await run_in_threadpool(utils.get_user_rating_counts)
+    media_total, media_counts = await run_in_threadpool(utils.get_media_file_summary)
+    ollama_url, ollama_api_key, ollama_model = await run_in_threadpool(utils.load_ollama_config)
     return templates.TemplateResponse(
         "admin.html",
-        {
+        utils.BASE_CONTEXT | {
             "request": request,
             "username": username,
             "users": users,
@@ -33,7 +39,6 @@ def admin_panel(request: Request):
             "ollama_api_key": ollama_api_key,
             "ollama_model": ollama_model,
             "show_back": True,
-            "show_admin": False,
             "show_stats_link": True,
             "body_class": "admin-page",
             "container_class": "admin-container",
@@ -41,7 +46,7 @@ def admin_panel(request: Request):
     )
 
 @router.post("/admin/change_password")
-def admin_change_password(
+async def admin_change_password(
     request: Request,
     target_user: str = Form(...),
     new_password: str = Form(...),
@@ -49,19 +54,19 @@ def admin_change_password(
     username = utils.get_username(request)
     if not utils.is_admin(username):
         return RedirectResponse("/login")
-    utils.change_user_password(target_user, new_password)
+    await run_in_threadpool(utils.change_user_password, target_user, new_password)
     return RedirectResponse("/admin", status_code=303)
 
 @router.post("/admin/delete_user")
-def admin_delete_user(request: Request, target_user: str = Form(...)):
+async def admin_delete_user(request: Request, target_user: str = Form(...)):
     username = utils.get_username(request)
     if not utils.is_admin(username):
         return RedirectResponse("/login")
-    utils.delete_user(target_user)
+    await run_in_threadpool(utils.delete_user, target_user)
     return RedirectResponse("/admin", status_code=303)
 
 @router.post("/admin/upload_media")
-def admin_upload_media(
+async def admin_upload_media(
     request: Request,
     media_files: list[UploadFile] = File(...),
 ):
@@ -70,12 +75,12 @@ def admin_upload_media(
         return RedirectResponse("/login")
     for media_file in media_files:
         file_path = os.path.join(utils.MEDIA_DIR, media_file.filename)
-        with open(file_path, "wb") as f:
-            f.write(media_file.file.read())
+        await run_in_threadpool(save_upload, media_file.file, file_path)
+    utils.invalidate_media_cache()
     return RedirectResponse("/admin", status_code=303)
 
 @router.post("/admin/set_ollama")
-def admin_set_ollama(
+async def admin_set_ollama(
     request: Request,
     url: str = Form(...),
     api_key: str = Form(""),
@@ -84,24 +89,24 @@ def admin_set_ollama(
     username = utils.get_username(request)
     if not utils.is_admin(username):
         return RedirectResponse("/login")
-    utils.save_ollama_config(url, api_key, model)
+    await run_in_threadpool(utils.save_ollama_config, url, api_key, model)
     return RedirectResponse("/admin", status_code=303)
 
 @router.post("/admin/generate_embeddings")
-def admin_generate_embeddings(request: Request):
+async def admin_generate_embeddings(request: Request):
     username = utils.get_username(request)
     if not utils.is_admin(username):
         return RedirectResponse("/login")
-    url, api_key, model = utils.load_ollama_config()
+    url, api_key, model = await run_in_threadpool(utils.load_ollama_config)
     if not url or not model:
         raise HTTPException(status_code=400, detail="Ollama configuration missing")
-    utils.generate_all_embeddings(url, api_key, model)
+    await run_in_threadpool(utils.generate_all_embeddings, url, api_key, model)
     return RedirectResponse("/admin", status_code=303)
 
 @router.post("/admin/remove_duplicates")
-def admin_remove_duplicates(request: Request):
+async def admin_remove_duplicates(request: Request):
     username = utils.get_username(request)
     if not utils.is_admin(username):
         return RedirectResponse("/login")
-    utils.remove_duplicate_images()
+    await run_in_threadpool(utils.remove_duplicate_images)
     return RedirectResponse("/admin", status_code=303)
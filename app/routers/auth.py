@@ -1,32 +1,29 @@
-import sqlite3
+from functools import cache
+
 from fastapi import HTTPException
 from fastapi import APIRouter, Request, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 
 from .. import utils
 
 router = APIRouter()
 
-templates = Jinja2Templates(directory="app/templates")
+templates = utils.templates
+
+# the login and register pages only depend on their template, so each is
+# rendered once per process
+@cache
+def render_anonymous_page(name: str) -> str:
+    return templates.get_template(name).render(utils.BASE_CONTEXT)
 
 @router.get("/login", response_class=HTMLResponse)
-def login_get(request: Request):
-    return templates.TemplateResponse(
-        "login.html",
-        {
-            "request": request,
-            "username": None,
-            "body_class": None,
-            "container_class": None,
-            "show_admin": False,
-            "show_back": False,
-        },
-    )
+async def login_get(request: Request):
+    return HTMLResponse(render_anonymous_page("login.html"))
 
 @router.post("/login")
-def login_post(username: str = Form(...), password: str = Form(...)):
-    if utils.verify_user(username, password):
+async def login_post(username: str = Form(...), password: str = Form(...)):
+    if await run_in_threadpool(utils.verify_user, username, password):
         response = RedirectResponse("/", status_code=303)
         token = utils.serializer.dumps(username)
         response.set_cookie("session", token, httponly=True)
@@ -34,37 +31,17 @@ def login_post(username: str = Form(...), password: str = Form(...)):
     return HTMLResponse("Invalid credentials", status_code=400)
 
 @router.get("/register", response_class=HTMLResponse)
-def register_get(request: Request):
-    return templates.TemplateResponse(
-        "register.html",
-        {
-            "request": request,
-            "username": None,
-            "body_class": None,
-            "container_class": None,
-            "show_admin": False,
-            "show_back": False,
-        },
-    )
+async def register_get(request: Request):
+    return HTMLResponse(render_anonymous_page("register.html"))
 
 @router.post("/register")
-def register_post(username: str = Form(...), password: str = Form(...)):
-    conn = sqlite3.connect(utils.DATABASE)
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "INSERT INTO users (username, password) VALUES (?, ?)",
-            (username, utils.hash_password(password)),
-        )
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
+async def register_post(username: str = Form(...), password: str = Form(...)):
+    if not await run_in_threadpool(utils.create_user, username, password):
         raise HTTPException(status_code=400, detail="Username exists")
-    conn.close()
     return RedirectResponse("/login", status_code=303)
 
 @router.get("/logout")
-def logout():
+async def logout():
     response = RedirectResponse("/login")
     response.delete_cookie("session")
     return response
@@ -1,14 +1,27 @@
 import os
 import hashlib
+import hmac
 import sqlite3
 import time
 import random
 import base64
 import io
 import json
-from typing import Any
-
+import math
+import queue
+import threading
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Iterator
+
+import jinja2
 import requests
+from argon2 import PasswordHasher, Type
+from argon2.exceptions import InvalidHashError, VerifyMismatchError
+from fastapi.templating import Jinja2Templates
 from itsdangerous import BadSignature, URLSafeSerializer
 from PIL import Image
 
@@ -17,184 +30,542 @@ MEDIA_DIR = os.environ.get("MEDIA_DIR", "/ranker-media")
 CONFIG_DIR = os.environ.get("CONFIG_DIR", "/config")
 DATABASE = os.path.join(CONFIG_DIR, "database.db")
 OLLAMA_CONFIG_PATH = os.path.join(CONFIG_DIR, "ollama_config.json")
-ADMIN_USERS = {u.strip() for u in os.environ.get("ADMIN_USERS", "").split(',') if u.strip()}
+ADMIN_USERS = frozenset(u.strip() for u in os.environ.get("ADMIN_USERS", "").split(',') if u.strip())
 BUILD_NUMBER = os.environ.get("BUILD_NUMBER", "dev")
+# internal nginx location that serves MEDIA_DIR; empty serves media from the app
+MEDIA_ACCEL_REDIRECT = os.environ.get("MEDIA_ACCEL_REDIRECT", "")
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "devkey")
 serializer = URLSafeSerializer(SECRET_KEY)
 
 NUM_MEDIA = 4
 
+password_hasher = PasswordHasher(
+    time_cost=3, memory_cost=64 * 1024, parallelism=1, type=Type.ID
+)
+# checked against for unknown usernames so failed logins cost the same time
+_DUMMY_PASSWORD_HASH = password_hasher.hash("")
+
 # Ensure directories exist
 os.makedirs(MEDIA_DIR, exist_ok=True)
 os.makedirs(CONFIG_DIR, exist_ok=True)
 
-
-def init_db() -> None:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password TEXT)"
-    )
-    cur.execute(
-        "CREATE TABLE IF NOT EXISTS media (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT UNIQUE, elo REAL DEFAULT 1000, rating_count INTEGER DEFAULT 0)"
+# templates are compiled once and never re-checked on disk while running
+templates = Jinja2Templates(
+    env=jinja2.Environment(
+        loader=jinja2.FileSystemLoader("app/templates"),
+        autoescape=True,
+        auto_reload=False,
+        bytecode_cache=jinja2.FileSystemBytecodeCache(),
     )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS rankings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            first_id INTEGER,
-            second_id INTEGER,
-            third_id INTEGER,
-            fourth_id INTEGER,
-            rated_at INTEGER
-        )
-        """
+)
+
+# layout flags read by base.html; handlers merge in only what differs
+BASE_CONTEXT = {
+    "username": None,
+    "body_class": None,
+    "container_class": None,
+    "show_admin": False,
+    "show_back": False,
+    "show_stats_link": False,
+}
+
+# sorted media filenames, rebuilt whenever MEDIA_DIR's mtime changes
+_media_cache: dict[str, Any] = {"dir": None, "mtime": -1, "files": []}
+
+_media_cache_lock = threading.Lock()
+
+# results derived only from media ELOs, tagged with the _rating_version they saw
+_rating_cache: dict[tuple, tuple[tuple, Any]] = {}
+
+# filenames committed to the media table, so listings only insert new files
+_known_media: set[str] = set()
+
+# idle connections kept open between requests, tagged with the database path
+_pool: queue.SimpleQueue[tuple[str, sqlite3.Connection]] = queue.SimpleQueue()
+# all writes go through one long-lived connection, one transaction at a time
+_writer: tuple[str, sqlite3.Connection] | None = None
+_write_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DATABASE, timeout=30, check_same_thread=False, cached_statements=256
     )
-    cur.execute(
+    conn.executescript(
         """
-        CREATE TABLE IF NOT EXISTS user_media (
-            username TEXT,
-            media_id INTEGER,
-            elo REAL DEFAULT 1000,
-            rating_count INTEGER DEFAULT 0,
-            PRIMARY KEY (username, media_id)
-        )
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA busy_timeout=30000;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-20000;
+        PRAGMA mmap_size=134217728;
         """
     )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS embeddings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            media_id INTEGER,
-            model TEXT,
-            embedding TEXT,
-            UNIQUE(media_id, model)
+    return conn
+
+
+@contextmanager
+def connection(conn: sqlite3.Connection | None = None) -> Iterator[sqlite3.Connection]:
+    """Borrow a pooled connection and hand it back once the block exits.
+
+    A connection the caller already holds is passed straight through.
+    """
+    if conn is not None:
+        yield conn
+        return
+    database = DATABASE
+    conn = None
+    while conn is None:
+        try:
+            pooled_database, pooled = _pool.get_nowait()
+        except queue.Empty:
+            conn = _connect()
+            break
+        if pooled_database == database:
+            conn = pooled
+        else:
+            pooled.close()
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _pool.put((database, conn))
+
+
+@contextmanager
+def write_connection() -> Iterator[sqlite3.Connection]:
+    """Run a write transaction on the shared writer, committing on success."""
+    global _writer
+    with _write_lock:
+        if _writer is None or _writer[0] != DATABASE:
+            if _writer is not None:
+                _writer[1].close()
+            _writer = (DATABASE, _connect())
+            # take the write lock when the transaction opens instead of
+            # upgrading mid-way, so other processes wait on busy_timeout
+            # rather than failing with SQLITE_BUSY
+            _writer[1].isolation_level = "IMMEDIATE"
+        conn = _writer[1]
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def close_connections() -> None:
+    global _writer
+    with _write_lock:
+        if _writer is not None:
+            _writer[1].close()
+            _writer = None
+    while True:
+        try:
+            _, conn = _pool.get_nowait()
+        except queue.Empty:
+            return
+        conn.close()
+
+
+_EMBEDDINGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    media_id INTEGER,
+    model TEXT,
+    embedding BLOB,
+    UNIQUE(media_id, model)
+);
+"""
+
+_SCHEMA = _EMBEDDINGS_SCHEMA + """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE,
+    password TEXT
+);
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT UNIQUE,
+    elo REAL DEFAULT 1000,
+    rating_count INTEGER DEFAULT 0,
+    norm_name TEXT
+);
+CREATE TABLE IF NOT EXISTS rankings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT,
+    first_id INTEGER,
+    second_id INTEGER,
+    third_id INTEGER,
+    fourth_id INTEGER,
+    rated_at INTEGER
+);
+CREATE TABLE IF NOT EXISTS user_media (
+    username TEXT,
+    media_id INTEGER,
+    elo REAL DEFAULT 1000,
+    rating_count INTEGER DEFAULT 0,
+    PRIMARY KEY (username, media_id)
+);
+-- users.username and media.filename are already indexed through their UNIQUE
+-- constraints, and user_media's primary key leads with username
+CREATE INDEX IF NOT EXISTS idx_rankings_user_time ON rankings(username, rated_at);
+CREATE INDEX IF NOT EXISTS idx_media_elo ON media(elo);
+-- lets the closest-ELO pick seek straight to its neighbours above and below
+CREATE INDEX IF NOT EXISTS idx_media_rated_elo ON media(elo) WHERE rating_count > 0;
+CREATE INDEX IF NOT EXISTS idx_media_norm ON media(norm_name, elo);
+"""
+
+
+def init_db() -> None:
+    close_connections()
+    conn = _connect()
+    cur = conn.cursor()
+    # bring older databases up to the current schema before creating indexes on it
+    media_columns = {row[1] for row in cur.execute("PRAGMA table_info(media)")}
+    if media_columns and "norm_name" not in media_columns:
+        cur.execute("ALTER TABLE media ADD COLUMN norm_name TEXT")
+    # embeddings used to be JSON text; move them to packed float32 blobs in one
+    # transaction, and finish a copy an older build left behind in embeddings_json
+    embedding_types = {
+        row[1]: row[2] for row in cur.execute("PRAGMA table_info(embeddings)")
+    }
+    migrate_embeddings = embedding_types.get("embedding", "").upper() == "TEXT"
+    leftover_json = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='embeddings_json'"
+    ).fetchone()
+    if migrate_embeddings or leftover_json:
+        cur.execute("BEGIN")
+        if migrate_embeddings:
+            cur.execute("ALTER TABLE embeddings RENAME TO embeddings_json")
+        cur.execute(_EMBEDDINGS_SCHEMA)
+        cur.execute("SELECT id, media_id, model, embedding FROM embeddings_json")
+        cur.executemany(
+            "INSERT OR IGNORE INTO embeddings (id, media_id, model, embedding) VALUES (?, ?, ?, ?)",
+            [
+                (row_id, media_id, model, encode_embedding(json.loads(embedding)))
+                for row_id, media_id, model, embedding in cur.fetchall()
+            ],
         )
-        """
+        cur.execute("DROP TABLE embeddings_json")
+        cur.execute("COMMIT")
+
+    cur.executescript(_SCHEMA)
+    cur.execute("SELECT id, filename FROM media WHERE norm_name IS NULL")
+    cur.executemany(
+        "UPDATE media SET norm_name=? WHERE id=?",
+        [(_normalize_name(filename), media_id) for media_id, filename in cur.fetchall()],
     )
     conn.commit()
+    cur.execute("PRAGMA optimize")
+    _known_media.clear()
+    _known_media.update(row[0] for row in cur.execute("SELECT filename FROM media"))
     conn.close()
+    invalidate_media_cache()
+    _rating_cache.clear()
 
 
 def is_admin(username: str | None) -> bool:
-    return username in ADMIN_USERS
+    return bool(username) and username in ADMIN_USERS
 
 
 def hash_password(password: str) -> str:
+    return password_hasher.hash(password)
+
+
+def _legacy_hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
 
-def get_username(request) -> str | None:
-    token = request.cookies.get("session")
-    if not token:
-        return None
+def check_password(stored: str, password: str) -> bool:
+    if not stored.startswith("$argon2"):
+        # accounts created before argon2 store an unsalted sha256 hex digest
+        return hmac.compare_digest(stored, _legacy_hash_password(password))
+    try:
+        return password_hasher.verify(stored, password)
+    except (VerifyMismatchError, InvalidHashError):
+        return False
+
+
+# session cookies are immutable signed values, so each is verified once per process
+@lru_cache(maxsize=4096)
+def _verify_token(token: str) -> str | None:
     try:
         return serializer.loads(token)
     except BadSignature:
         return None
 
 
+def get_username(request) -> str | None:
+    token = request.cookies.get("session")
+    if not token:
+        return None
+    return _verify_token(token)
+
+
 def verify_user(username: str, password: str) -> bool:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("SELECT password FROM users WHERE username=?", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return row is not None and row[0] == hash_password(password)
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT password FROM users WHERE username=?", (username,))
+        row = cur.fetchone()
+    if row is None:
+        check_password(_DUMMY_PASSWORD_HASH, password)
+        return False
+    stored = row[0]
+    if not check_password(stored, password):
+        return False
+    if not stored.startswith("$argon2") or password_hasher.check_needs_rehash(stored):
+        # upgrade legacy digests and outdated argon2 parameters on login
+        password_hash = hash_password(password)
+        with write_connection() as conn:
+            conn.execute(
+                "UPDATE users SET password=? WHERE username=? AND password=?",
+                (password_hash, username, stored),
+            )
+    return True
+
+
+def create_user(username: str, password: str) -> bool:
+    password_hash = hash_password(password)
+    try:
+        with write_connection() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "INSERT INTO users (username, password) VALUES (?, ?)",
+                (username, password_hash),
+            )
+    except sqlite3.IntegrityError:
+        return False
+    return True
 
 
 def list_users() -> list[str]:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("SELECT username FROM users")
-    rows = [row[0] for row in cur.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT username FROM users")
+        rows = [row[0] for row in cur.fetchall()]
     return rows
 
 
+def invalidate_media_cache() -> None:
+    # directory mtimes can be coarse, so writers drop the listing explicitly
+    _media_cache["mtime"] = -1
+
+
+def _cached_media_files() -> list[str]:
+    """The shared cached listing; callers must not mutate it."""
+    mtime = os.stat(MEDIA_DIR).st_mtime_ns
+    if _media_cache["dir"] != MEDIA_DIR or _media_cache["mtime"] != mtime:
+        # one thread rescans while concurrent requests wait for its result
+        with _media_cache_lock:
+            if _media_cache["dir"] != MEDIA_DIR or _media_cache["mtime"] != mtime:
+                with os.scandir(MEDIA_DIR) as entries:
+                    files = sorted(e.name for e in entries if e.is_file())
+                # new files get their media rows here, off the per-request path
+                register_media(files)
+                _media_cache.update(dir=MEDIA_DIR, mtime=mtime, files=files)
+    return _media_cache["files"]
+
+
+_NAME_TABLE = str.maketrans("", "", "_0123456789")
+
+
+def _normalize_name(filename: str) -> str:
+    """Group key for a media file: lowercase stem without underscores or digits."""
+    name = os.path.splitext(filename)[0].lower().translate(_NAME_TABLE)
+    if not name.isascii():
+        # str.isdigit also matches non-ASCII digits such as superscripts
+        name = ''.join(ch for ch in name if not ch.isdigit())
+    return name
+
+
 def get_media_file_summary() -> tuple[int, list[tuple[str, int]]]:
-    files = [f for f in os.listdir(MEDIA_DIR) if os.path.isfile(os.path.join(MEDIA_DIR, f))]
+    files = _cached_media_files()
     total = len(files)
     counts: dict[str, int] = {}
     for f in files:
-        name, _ = os.path.splitext(f)
-        name = name.lower().replace('_', '')
-        name = ''.join(ch for ch in name if not ch.isdigit())
+        name = _normalize_name(f)
         counts[name] = counts.get(name, 0) + 1
     sorted_counts = sorted(counts.items(), key=lambda x: (-x[1], x[0]))
     return total, sorted_counts
 
 
+# statements on the /rate write path, kept as fixed text so the writer's
+# statement cache hits on every request; IN (...) lists are sized per call
+_INSERT_MEDIA_SQL = "INSERT OR IGNORE INTO media (filename, norm_name) VALUES (?, ?)"
+_SELECT_MEDIA_SQL = "SELECT filename, id, elo, rating_count FROM media WHERE filename IN ({})"
+_INSERT_RANKING_SQL = """
+    INSERT INTO rankings (username, first_id, second_id, third_id, fourth_id, rated_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+_INSERT_USER_MEDIA_SQL = "INSERT OR IGNORE INTO user_media (username, media_id) VALUES (?, ?)"
+_SELECT_USER_MEDIA_SQL = (
+    "SELECT media_id, elo, rating_count FROM user_media WHERE username=? AND media_id IN ({})"
+)
+_UPDATE_MEDIA_SQL = "UPDATE media SET elo=?, rating_count=? WHERE id=?"
+_UPDATE_USER_MEDIA_SQL = "UPDATE user_media SET elo=?, rating_count=? WHERE username=? AND media_id=?"
+
+
+def insert_media(cur: sqlite3.Cursor, files: list[str]) -> None:
+    cur.executemany(_INSERT_MEDIA_SQL, [(f, _normalize_name(f)) for f in files])
+
+
+def register_media(files: list[str]) -> None:
+    """Make sure every listed file has a media row, writing only new names."""
+    new_files = [f for f in files if f not in _known_media]
+    if new_files:
+        with write_connection() as conn:
+            insert_media(conn.cursor(), new_files)
+        _known_media.update(new_files)
+
+
 def get_media_files(username: str, count: int) -> list[str]:
-    files = [f for f in os.listdir(MEDIA_DIR) if os.path.isfile(os.path.join(MEDIA_DIR, f))]
+    files = _cached_media_files()
     if not files:
         return []
 
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    for f in files:
-        cur.execute("INSERT OR IGNORE INTO media (filename) VALUES (?)", (f,))
-    conn.commit()
-
-    cur.execute("SELECT filename, elo, rating_count FROM media")
-    rows = cur.fetchall()
-    conn.close()
-    stats = {row[0]: (row[1], row[2]) for row in rows}
-
-    random.shuffle(files)
     base_count = min(3, len(files))
-    base_selection = files[:base_count]
+    base_selection = random.sample(files, base_count)
+    placeholders = ",".join("?" * base_count)
 
     if len(files) <= 3 or count <= base_count:
         random.shuffle(base_selection)
         return base_selection[: min(count, len(base_selection))]
 
-    avg = sum(stats[f][0] for f in base_selection) / len(base_selection)
-    rated_candidates = [
-        (fname, elo)
-        for fname, (elo, cnt) in stats.items()
-        if cnt > 0 and fname not in base_selection
-    ]
-    fourth: str | None = None
-    if rated_candidates:
-        fourth = min(rated_candidates, key=lambda r: abs(r[1] - avg))[0]
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"""
+            WITH base AS (
+                SELECT AVG(elo) AS avg_elo FROM media WHERE filename IN ({placeholders})
+            )
+            SELECT filename FROM (
+                SELECT * FROM (
+                    SELECT filename, id, elo - (SELECT avg_elo FROM base) AS diff
+                    FROM media
+                    WHERE rating_count > 0 AND elo >= (SELECT avg_elo FROM base)
+                        AND filename NOT IN ({placeholders})
+                    ORDER BY elo, id
+                    LIMIT 1
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT filename, id, (SELECT avg_elo FROM base) - elo AS diff
+                    FROM media
+                    WHERE rating_count > 0 AND elo < (SELECT avg_elo FROM base)
+                        AND filename NOT IN ({placeholders})
+                    ORDER BY elo DESC, id
+                    LIMIT 1
+                )
+            )
+            ORDER BY diff, id
+            LIMIT 1
+            """,
+            (*base_selection, *base_selection, *base_selection),
+        )
+        row = cur.fetchone()
+    if row:
+        fourth = row[0]
     else:
-        remaining = [f for f in files if f not in base_selection]
-        if remaining:
-            fourth = random.choice(remaining)
-    chosen = base_selection + ([fourth] if fourth else [])
+        # nothing rated to pair against (e.g. a fresh install): draw until we
+        # miss the base selection instead of copying the listing without it;
+        # files holds more than three distinct names here, so this ends fast
+        base_set = set(base_selection)
+        fourth = random.choice(files)
+        while fourth in base_set:
+            fourth = random.choice(files)
+    chosen = base_selection + [fourth]
     random.shuffle(chosen)
     return chosen[: min(count, len(chosen))]
 
 
+_LN10_OVER_400 = math.log(10) / 400
+
+
+def update_elo(ids: list[int], ratings: dict[int, float], counts: dict[int, int]) -> None:
+    """Apply the pairwise ELO updates for ``ids``, ordered best first, in place."""
+    K = 32
+    for i in range(len(ids)):
+        for j in range(i + 1, len(ids)):
+            winner_id = ids[i]
+            loser_id = ids[j]
+            Ra = ratings[winner_id]
+            Rb = ratings[loser_id]
+            # Ea = 1 / (1 + 10 ** ((Rb - Ra) / 400)) and Eb = 1 - Ea, so the
+            # loser gives up exactly what the winner gains
+            Ea = 1 / (1 + math.exp((Rb - Ra) * _LN10_OVER_400))
+            delta = K * (1 - Ea)
+            ratings[winner_id] = Ra + delta
+            ratings[loser_id] = Rb - delta
+            counts[winner_id] += 1
+            counts[loser_id] += 1
+
+
+def record_ranking(username: str, files: list[str]) -> None:
+    ts = int(time.time())
+    with write_connection() as conn:
+        cur = conn.cursor()
+        insert_media(cur, files)
+        placeholders = ",".join("?" * len(files))
+        cur.execute(_SELECT_MEDIA_SQL.format(placeholders), files)
+        media_rows = {row[0]: row[1:] for row in cur.fetchall()}
+        ids = [media_rows[f][0] for f in files]
+        ratings = {media_id: elo for media_id, elo, _ in media_rows.values()}
+        counts = {media_id: cnt for media_id, _, cnt in media_rows.values()}
+        first_id = ids[0] if len(ids) > 0 else None
+        second_id = ids[1] if len(ids) > 1 else None
+        third_id = ids[2] if len(ids) > 2 else None
+        fourth_id = ids[3] if len(ids) > 3 else None
+        cur.execute(
+            _INSERT_RANKING_SQL, (username, first_id, second_id, third_id, fourth_id, ts)
+        )
+        user_ratings: dict[int, float] = {}
+        user_counts: dict[int, int] = {}
+        cur.executemany(_INSERT_USER_MEDIA_SQL, [(username, media_id) for media_id in ids])
+        cur.execute(_SELECT_USER_MEDIA_SQL.format(placeholders), (username, *ids))
+        for media_id, u_elo, u_cnt in cur.fetchall():
+            user_ratings[media_id] = u_elo
+            user_counts[media_id] = u_cnt
+
+        update_elo(ids, ratings, counts)
+        update_elo(ids, user_ratings, user_counts)
+
+        cur.executemany(
+            _UPDATE_MEDIA_SQL,
+            [(ratings[media_id], counts[media_id], media_id) for media_id in ratings],
+        )
+        cur.executemany(
+            _UPDATE_USER_MEDIA_SQL,
+            [(user_ratings[media_id], user_counts[media_id], username, media_id) for media_id in user_ratings],
+        )
+
+
 def change_user_password(username: str, new_password: str) -> None:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET password=? WHERE username=?",
-        (hash_password(new_password), username),
-    )
-    conn.commit()
-    conn.close()
+    password_hash = hash_password(new_password)
+    with write_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE users SET password=? WHERE username=?",
+            (password_hash, username),
+        )
 
 
 def get_user_rating_counts() -> dict[str, int]:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("SELECT username, COUNT(*) FROM rankings GROUP BY username")
-    rows = cur.fetchall()
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT username, COUNT(*) FROM rankings GROUP BY username")
+        rows = cur.fetchall()
     return {row[0]: row[1] for row in rows}
 
 
-def get_rating_event_count() -> int:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM rankings")
-    count = cur.fetchone()[0]
-    conn.close()
+def get_rating_event_count(conn: sqlite3.Connection | None = None) -> int:
+    with connection(conn) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM rankings")
+        count = cur.fetchone()[0]
     return count
 
 
@@ -218,193 +589,329 @@ def save_ollama_config(url: str, api_key: str, model: str) -> None:
         json.dump({'url': url, 'api_key': api_key, 'model': model}, f)
 
 
+EMBEDDING_WORKERS = 8
+EMBEDDING_BATCH_SIZE = 50
+# jobs submitted ahead of the writer; bounds how many vectors sit in memory
+EMBEDDING_MAX_PENDING = EMBEDDING_WORKERS * 2
+
+
+def encode_embedding(embedding: list[float]) -> bytes:
+    """Pack an embedding as native-endian float32 for the BLOB column."""
+    return array('f', embedding).tobytes()
+
+
+def load_embedding(blob: bytes) -> array:
+    embedding = array('f')
+    embedding.frombytes(blob)
+    return embedding
+
+
+# formats Ollama decodes itself; anything else is re-encoded as PNG
+_PASSTHROUGH_FORMATS = frozenset({"JPEG", "PNG", "WEBP"})
+
+
+def _image_payload(path: str) -> str:
+    with Image.open(path) as img:
+        if (
+            img.format in _PASSTHROUGH_FORMATS
+            and img.mode == 'RGB'
+            and not getattr(img, 'is_animated', False)
+        ):
+            # a single RGB frame the model can read as-is; skip the decode
+            # and PNG re-encode entirely
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            if getattr(img, 'is_animated', False):
+                img.seek(0)
+            img = img.convert('RGB')
+            buf = io.BytesIO()
+            img.save(buf, format='PNG')
+            data = buf.getvalue()
+    return base64.b64encode(data).decode('utf-8')
+
+
+def _fetch_embedding(endpoint: str, headers: dict, model: str, path: str) -> list[float] | None:
+    try:
+        b64 = _image_payload(path)
+    except Exception:
+        return None
+    try:
+        resp = requests.post(
+            endpoint,
+            json={'model': model, 'prompt': b64},
+            headers=headers,
+            timeout=10,
+        )
+        resp.raise_for_status()
+        return resp.json().get('embedding')
+    except Exception:
+        return None
+
+
+def _store_embeddings(rows: list[tuple[int, str, bytes]]) -> int:
+    if not rows:
+        return 0
+    with write_connection() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT OR IGNORE INTO embeddings (media_id, model, embedding) VALUES (?, ?, ?)",
+            rows,
+        )
+        return cur.rowcount
+
+
 def generate_all_embeddings(url: str, api_key: str, model: str) -> int:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    files = [f for f in os.listdir(MEDIA_DIR) if os.path.isfile(os.path.join(MEDIA_DIR, f))]
-    for fname in files:
-        cur.execute("INSERT OR IGNORE INTO media (filename) VALUES (?)", (fname,))
-    conn.commit()
+    # refreshing the listing gives every new file a media row
+    _cached_media_files()
 
-    cur.execute("SELECT id, filename FROM media")
-    rows = cur.fetchall()
-    headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
-    processed = 0
-    for media_id, fname in rows:
+    with connection() as conn:
+        cur = conn.cursor()
         cur.execute(
-            "SELECT 1 FROM embeddings WHERE media_id=? AND model=?",
-            (media_id, model),
-        )
-        if cur.fetchone():
-            continue
-        path = os.path.join(MEDIA_DIR, fname)
-        try:
-            with Image.open(path) as img:
-                if getattr(img, 'is_animated', False):
-                    img.seek(0)
-                img = img.convert('RGB')
-                buf = io.BytesIO()
-                img.save(buf, format='PNG')
-            b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-        except Exception:
-            continue
-        try:
-            resp = requests.post(
-                url.rstrip('/') + '/api/embeddings',
-                json={'model': model, 'prompt': b64},
-                headers=headers,
-                timeout=10,
+            """
+            SELECT id, filename FROM media m
+            WHERE NOT EXISTS (
+                SELECT 1 FROM embeddings e WHERE e.media_id = m.id AND e.model = ?
             )
-            resp.raise_for_status()
-            data = resp.json()
-            emb = data.get('embedding')
-            if emb is None:
-                continue
-            cur.execute(
-                "INSERT INTO embeddings (media_id, model, embedding) VALUES (?, ?, ?)",
-                (media_id, model, json.dumps(emb)),
-            )
-            conn.commit()
-            processed += 1
-        except Exception:
-            continue
-    conn.close()
+            """,
+            (model,),
+        )
+        rows = cur.fetchall()
+    headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+    endpoint = url.rstrip('/') + '/api/embeddings'
+
+    # encoding and the HTTP round trips overlap on a small pool, while results
+    # are written back from this thread in batched transactions; only a window
+    # of jobs is in flight and each future is dropped once consumed
+    processed = 0
+    batch: list[tuple[int, str, bytes]] = []
+    jobs = iter(rows)
+    pending: dict = {}
+    with ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS) as pool:
+        while True:
+            for media_id, fname in islice(jobs, EMBEDDING_MAX_PENDING - len(pending)):
+                future = pool.submit(
+                    _fetch_embedding, endpoint, headers, model, os.path.join(MEDIA_DIR, fname)
+                )
+                pending[future] = media_id
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                media_id = pending.pop(future)
+                emb = future.result()
+                if emb is None:
+                    continue
+                batch.append((media_id, model, encode_embedding(emb)))
+                if len(batch) >= EMBEDDING_BATCH_SIZE:
+                    processed += _store_embeddings(batch)
+                    batch = []
+    processed += _store_embeddings(batch)
     return processed
 
 
 def delete_user(username: str) -> None:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE username=?", (username,))
-    cur.execute("DELETE FROM rankings WHERE username=?", (username,))
-    conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM users WHERE username=?", (username,))
+        cur.execute("DELETE FROM rankings WHERE username=?", (username,))
 
 
-def get_user_media_stats(username: str, limit: int = 5) -> tuple[
+def get_user_media_stats(
+    username: str, limit: int = 5, conn: sqlite3.Connection | None = None
+) -> tuple[
     list[tuple[str, float, float, int, int]], list[tuple[str, float, float, int, int]]
 ]:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute(
-        """
+    query = """
         SELECT m.filename, um.elo, m.elo, um.rating_count, m.rating_count
         FROM user_media um JOIN media m ON um.media_id=m.id
         WHERE um.username=?
-        """,
-        (username,),
-    )
-    rows = cur.fetchall()
-    conn.close()
-    if not rows:
-        return [], []
-    rows.sort(key=lambda r: r[1], reverse=True)
-    highest = rows[:limit]
-    lowest = rows[-limit:][::-1]
+        ORDER BY um.elo {}, m.id {}
+        LIMIT ?
+    """
+    with connection(conn) as conn:
+        cur = conn.cursor()
+        cur.execute(query.format("DESC", "ASC"), (username, limit))
+        highest = cur.fetchall()
+        cur.execute(query.format("ASC", "DESC"), (username, limit))
+        lowest = cur.fetchall()
     return highest, lowest
 
 
-def get_global_media_stats_with_user(username: str, limit: int = 5) -> tuple[
+def get_global_media_stats_with_user(
+    username: str, limit: int = 5, conn: sqlite3.Connection | None = None
+) -> tuple[
     list[tuple[str, float, float | None, int, int]],
     list[tuple[str, float, float | None, int, int]],
 ]:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("SELECT filename, elo, rating_count FROM media")
-    global_rows = cur.fetchall()
-    if not global_rows:
-        conn.close()
-        return [], []
-    cur.execute(
-        """
-        SELECT m.filename, um.elo, um.rating_count
-        FROM user_media um JOIN media m ON um.media_id = m.id
-        WHERE um.username=?
-        """,
-        (username,),
-    )
-    user_rows = {row[0]: (row[1], row[2]) for row in cur.fetchall()}
-    conn.close()
-
-    global_rows.sort(key=lambda r: r[1], reverse=True)
-    highest = global_rows[:limit]
-    lowest = global_rows[-limit:][::-1]
-    highest = [
-        (
-            m,
-            g_elo,
-            user_rows.get(m, (None, 0))[0],
-            g_cnt,
-            user_rows.get(m, (None, 0))[1],
-        )
-        for m, g_elo, g_cnt in highest
-    ]
-    lowest = [
-        (
-            m,
-            g_elo,
-            user_rows.get(m, (None, 0))[0],
-            g_cnt,
-            user_rows.get(m, (None, 0))[1],
-        )
-        for m, g_elo, g_cnt in lowest
-    ]
+    query = """
+        SELECT m.filename, m.elo, um.elo, m.rating_count,
+               COALESCE(um.rating_count, 0)
+        FROM media m
+        LEFT JOIN user_media um ON um.media_id = m.id AND um.username = ?
+        ORDER BY m.elo {}, m.id {}
+        LIMIT ?
+    """
+    with connection(conn) as conn:
+        cur = conn.cursor()
+        cur.execute(query.format("DESC", "ASC"), (username, limit))
+        highest = cur.fetchall()
+        cur.execute(query.format("ASC", "DESC"), (username, limit))
+        lowest = cur.fetchall()
     return highest, lowest
 
 
-def get_elo_rankings(limit: int = 20) -> list[tuple[str, float, int]]:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT filename, elo, rating_count FROM media ORDER BY elo DESC LIMIT ?",
-        (limit,),
+def _rating_version(conn: sqlite3.Connection) -> tuple:
+    # media ELOs only change alongside a new rankings row or media row; the
+    # AUTOINCREMENT counters never go back, even when delete_user removes the
+    # newest rankings, so this moves on every such write from any process
+    return (
+        DATABASE,
+        *conn.execute(
+            """
+            SELECT (SELECT seq FROM sqlite_sequence WHERE name='rankings'),
+                   (SELECT seq FROM sqlite_sequence WHERE name='media')
+            """
+        ).fetchone(),
     )
-    rows = cur.fetchall()
-    conn.close()
+
+
+def get_elo_rankings(
+    limit: int = 20, conn: sqlite3.Connection | None = None
+) -> list[tuple[str, float, int]]:
+    with connection(conn) as conn:
+        version = _rating_version(conn)
+        cached = _rating_cache.get(("elo_rankings", limit))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT filename, elo, rating_count FROM media ORDER BY elo DESC LIMIT ?",
+            (limit,),
+        )
+        rows = cur.fetchall()
+    _rating_cache[("elo_rankings", limit)] = (version, rows)
     return rows
 
 
-def get_name_group_elo_stats() -> list[tuple[str, int, int, float, float, float, float]]:
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    cur.execute("SELECT filename, elo, rating_count FROM media")
-    rows = cur.fetchall()
-    conn.close()
-    groups: dict[str, list[tuple[float, int]]] = {}
-    for media, rating, cnt in rows:
-        name, _ = os.path.splitext(media)
-        name = name.lower().replace('_', '')
-        name = ''.join(ch for ch in name if not ch.isdigit())
-        groups.setdefault(name, []).append((rating, cnt))
-
-    stats = []
-    for name, values in groups.items():
-        count = len(values)
-        total_ratings = sum(c for _, c in values)
-        ratings = [r for r, _ in values]
-        avg = sum(ratings) / count
-        mn = min(ratings)
-        mx = max(ratings)
-        var = sum((r - avg) ** 2 for r in ratings) / count
-        std = var ** 0.5
-        stats.append((name, count, total_ratings, mn, mx, avg, std))
-
-    stats.sort(key=lambda s: -s[5])
+def get_name_group_elo_stats(
+    conn: sqlite3.Connection | None = None,
+) -> list[tuple[str, int, int, float, float, float, float]]:
+    with connection(conn) as conn:
+        version = _rating_version(conn)
+        cached = _rating_cache.get(("name_groups",))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        cur = conn.cursor()
+        cur.execute(
+            """
+            WITH g AS (
+                SELECT norm_name, AVG(elo) AS avg_elo FROM media GROUP BY norm_name
+            )
+            SELECT m.norm_name, COUNT(*), SUM(m.rating_count), MIN(m.elo), MAX(m.elo),
+                   g.avg_elo, AVG((m.elo - g.avg_elo) * (m.elo - g.avg_elo))
+            FROM media m JOIN g ON g.norm_name = m.norm_name
+            GROUP BY m.norm_name
+            ORDER BY g.avg_elo DESC, MIN(m.id)
+            """
+        )
+        rows = cur.fetchall()
+    stats = [(*row[:6], row[6] ** 0.5) for row in rows]
+    _rating_cache[("name_groups",)] = (version, stats)
     return stats
 
 
-def remove_duplicate_images() -> int:
-    files = [f for f in os.listdir(MEDIA_DIR) if os.path.isfile(os.path.join(MEDIA_DIR, f))]
-    hashes: dict[str, list[str]] = {}
-    for fname in files:
-        path = os.path.join(MEDIA_DIR, fname)
+def get_stats(username: str) -> dict[str, Any]:
+    """Everything the stats page shows, read from a single snapshot."""
+    with connection() as conn:
+        # one read transaction so the sections agree with each other
+        conn.execute("BEGIN")
         try:
-            with Image.open(path) as img:
-                img = img.convert('RGB')
-                h = hashlib.sha256(img.tobytes()).hexdigest()
-        except Exception:
-            continue
-        hashes.setdefault(h, []).append(fname)
+            global_highest, global_lowest = get_global_media_stats_with_user(username, conn=conn)
+            user_highest, user_lowest = get_user_media_stats(username, conn=conn)
+            stats = {
+                "global_highest": global_highest,
+                "global_lowest": global_lowest,
+                "user_highest": user_highest,
+                "user_lowest": user_lowest,
+                "elo_ranking": get_elo_rankings(conn=conn),
+                "name_group_stats": get_name_group_elo_stats(conn),
+                "rating_total": get_rating_event_count(conn),
+            }
+        finally:
+            conn.rollback()
+    stats["media_total"], stats["media_counts"] = get_media_file_summary()
+    return stats
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _image_size(path: str) -> tuple[int, int] | None:
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def _pixel_digest(path: str) -> str | None:
+    try:
+        with Image.open(path) as img:
+            img = img.convert('RGB')
+            return hashlib.sha256(img.tobytes()).hexdigest()
+    except Exception:
+        return None
+
+
+def remove_duplicate_images() -> int:
+    with os.scandir(MEDIA_DIR) as entries:
+        files = [(e.name, e.path) for e in entries if e.is_file()]
+    # Pillow and hashlib release the GIL while decoding and hashing, so the
+    # per-file work runs on a thread pool; grouping and removal stay serial
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        # pixel-identical images share dimensions, which Image.open reads from
+        # the header without decoding, so only images with a same-sized peer
+        # are hashed
+        by_size: dict[tuple[int, int], list[tuple[str, str]]] = {}
+        for (fname, path), size in zip(files, pool.map(_image_size, [p for _, p in files])):
+            if size is not None:
+                by_size.setdefault(size, []).append((fname, path))
+        candidates = [
+            (size, fname, path)
+            for size, group in by_size.items()
+            if len(group) > 1
+            for fname, path in group
+        ]
+
+        # byte-identical copies are grouped first so each distinct file is
+        # decoded at most once
+        by_bytes: dict[tuple[int, int], dict[str, list[tuple[str, str]]]] = {}
+        digests = pool.map(_file_digest, [path for _, _, path in candidates])
+        for (size, fname, path), digest in zip(candidates, digests):
+            by_bytes.setdefault(size, {}).setdefault(digest, []).append((fname, path))
+
+        to_decode = [
+            (size, group)
+            for size, groups in by_bytes.items()
+            if len(groups) > 1
+            for group in groups.values()
+        ]
+        pixel_digests = pool.map(_pixel_digest, [group[0][1] for _, group in to_decode])
+
+        hashes: dict[tuple[tuple[int, int], str], list[str]] = {}
+        for size, groups in by_bytes.items():
+            if len(groups) == 1:
+                (digest, group), = groups.items()
+                hashes[(size, digest)] = [fname for fname, _ in group]
+        for (size, group), digest in zip(to_decode, pixel_digests):
+            if digest is not None:
+                hashes.setdefault((size, digest), []).extend(fname for fname, _ in group)
 
     removed = 0
     for dup_files in hashes.values():
@@ -417,4 +924,6 @@ def remove_duplicate_images() -> int:
                     removed += 1
                 except FileNotFoundError:
                     pass
+    if removed:
+        invalidate_media_cache()
     return removed
@@ -7,6 +7,7 @@ import tempfile
 from PIL import Image
 import base64
 import io
+import json
 
 # Ensure the app uses a writable location during import
 _base = tempfile.mkdtemp()
@@ -162,6 +163,28 @@ def test_remove_duplicates_endpoint(admin_client: TestClient):
     assert path3.exists()
 
 
+def test_remove_duplicates_compares_pixels(client: TestClient):
+    media = Path(main.MEDIA_DIR)
+    pattern = Image.new("RGB", (8, 8))
+    pattern.putdata([(x * 32, y * 32, (x * y) % 256) for y in range(8) for x in range(8)])
+    pattern.save(media / "a.png", compress_level=9)
+    pattern.save(media / "b.png", compress_level=0)
+    pattern.save(media / "c.bmp")
+    Image.new("RGB", (8, 8), color="blue").save(media / "d.png")
+    (media / "notes.txt").write_bytes(b"not an image")
+    (media / "notes_copy.txt").write_bytes(b"not an image")
+    assert (media / "a.png").read_bytes() != (media / "b.png").read_bytes()
+
+    removed = main.utils.remove_duplicate_images()
+
+    assert removed == 2
+    survivors = [name for name in ("a.png", "b.png", "c.bmp") if (media / name).exists()]
+    assert len(survivors) == 1
+    assert (media / "d.png").exists()
+    assert (media / "notes.txt").exists()
+    assert (media / "notes_copy.txt").exists()
+
+
 def test_generate_embeddings(admin_client: TestClient, tmp_path: Path, monkeypatch):
     admin_client.post("/register", data={"username": "admin", "password": "x"}, follow_redirects=False)
     admin_client.post("/login", data={"username": "admin", "password": "x"}, follow_redirects=False)
@@ -200,8 +223,91 @@ def test_generate_embeddings(admin_client: TestClient, tmp_path: Path, monkeypat
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) FROM embeddings")
     count = cur.fetchone()[0]
+    cur.execute("SELECT embedding FROM embeddings")
+    stored = cur.fetchone()[0]
     conn.close()
     assert count == 1
+    assert list(main.utils.load_embedding(stored)) == pytest.approx([0.1, 0.2])
+
+
+def test_generate_embeddings_flushes_in_batches(client: TestClient, monkeypatch):
+    for i in range(12):
+        (Path(main.MEDIA_DIR) / f"img{i}.png").write_bytes(b"x")
+    monkeypatch.setattr(main.utils, "EMBEDDING_WORKERS", 2)
+    monkeypatch.setattr(main.utils, "EMBEDDING_MAX_PENDING", 2)
+    monkeypatch.setattr(main.utils, "EMBEDDING_BATCH_SIZE", 5)
+
+    fetched = []
+    flushes = []
+    store = main.utils._store_embeddings
+
+    def fake_fetch(endpoint, headers, model, path):
+        fetched.append(path)
+        return [0.1]
+
+    def spy_store(rows):
+        flushes.append((len(rows), len(fetched)))
+        return store(rows)
+
+    monkeypatch.setattr(main.utils, "_fetch_embedding", fake_fetch)
+    monkeypatch.setattr(main.utils, "_store_embeddings", spy_store)
+
+    assert main.utils.generate_all_embeddings("http://example", "", "m") == 12
+    assert [size for size, _ in flushes] == [5, 5, 2]
+    # only the batch plus the in-flight window has been fetched at each flush
+    for i, (_, seen) in enumerate(flushes[:-1]):
+        assert seen <= 5 * (i + 1) + 2
+
+
+def test_json_embeddings_migrated(client: TestClient):
+    conn = sqlite3.connect(main.DATABASE)
+    conn.execute("DROP TABLE embeddings")
+    conn.execute(
+        "CREATE TABLE embeddings (id INTEGER PRIMARY KEY AUTOINCREMENT, media_id INTEGER, model TEXT, embedding TEXT, UNIQUE(media_id, model))"
+    )
+    conn.execute(
+        "INSERT INTO embeddings (media_id, model, embedding) VALUES (?, ?, ?)",
+        (1, "m", json.dumps([0.5, -1.0])),
+    )
+    conn.commit()
+    conn.close()
+
+    main.init_db()
+
+    conn = sqlite3.connect(main.DATABASE)
+    cur = conn.cursor()
+    cur.execute("SELECT media_id, model, embedding FROM embeddings")
+    media_id, model, stored = cur.fetchone()
+    conn.close()
+    assert (media_id, model) == (1, "m")
+    assert list(main.utils.load_embedding(stored)) == [0.5, -1.0]
+
+    # a copy interrupted after the rename leaves embeddings_json beside an
+    # empty BLOB table; the next start finishes it
+    conn = sqlite3.connect(main.DATABASE)
+    conn.execute("DELETE FROM embeddings")
+    conn.execute(
+        "CREATE TABLE embeddings_json (id INTEGER PRIMARY KEY AUTOINCREMENT, media_id INTEGER, model TEXT, embedding TEXT, UNIQUE(media_id, model))"
+    )
+    conn.execute(
+        "INSERT INTO embeddings_json (media_id, model, embedding) VALUES (?, ?, ?)",
+        (2, "m", json.dumps([0.25])),
+    )
+    conn.commit()
+    conn.close()
+
+    main.init_db()
+
+    conn = sqlite3.connect(main.DATABASE)
+    cur = conn.cursor()
+    rows = cur.execute("SELECT media_id, model, embedding FROM embeddings").fetchall()
+    leftover = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE name='embeddings_json'"
+    ).fetchone()
+    conn.close()
+    assert [(media_id, model) for media_id, model, _ in rows] == [(2, "m")]
+    assert list(main.utils.load_embedding(rows[0][2])) == [0.25]
+    assert leftover is None
 
 
 def test_gif_first_frame_used(admin_client: TestClient, tmp_path: Path, monkeypatch):
@@ -237,3 +343,130 @@ def test_gif_first_frame_used(admin_client: TestClient, tmp_path: Path, monkeypa
     data = base64.b64decode(captured["prompt"])
     with Image.open(io.BytesIO(data)) as im:
         assert im.getpixel((0, 0)) == (255, 0, 0)
+
+
+def test_password_hashing(client: TestClient):
+    client.post("/register", data={"username": "alice", "password": "secret"}, follow_redirects=False)
+
+    conn = sqlite3.connect(main.DATABASE)
+    cur = conn.cursor()
+    cur.execute("SELECT password FROM users WHERE username=?", ("alice",))
+    stored = cur.fetchone()[0]
+    legacy = main.utils._legacy_hash_password("old")
+    cur.execute("INSERT INTO users (username, password) VALUES (?, ?)", ("legacy", legacy))
+    conn.commit()
+    conn.close()
+    assert stored.startswith("$argon2id$")
+
+    resp = client.post("/login", data={"username": "alice", "password": "wrong"}, follow_redirects=False)
+    assert resp.status_code == 400
+    resp = client.post("/login", data={"username": "legacy", "password": "old"}, follow_redirects=False)
+    assert resp.status_code == 303
+
+    conn = sqlite3.connect(main.DATABASE)
+    cur = conn.cursor()
+    cur.execute("SELECT password FROM users WHERE username=?", ("legacy",))
+    assert cur.fetchone()[0].startswith("$argon2id$")
+    conn.close()
+    resp = client.post("/login", data={"username": "legacy", "password": "old"}, follow_redirects=False)
+    assert resp.status_code == 303
+
+
+def test_media_listing_refreshes(client: TestClient):
+    client.post("/register", data={"username": "u", "password": "p"}, follow_redirects=False)
+    client.post("/login", data={"username": "u", "password": "p"}, follow_redirects=False)
+
+    resp = client.get("/")
+    assert resp.status_code == 404
+
+    (Path(main.MEDIA_DIR) / "first.jpg").write_bytes(b"1")
+    resp = client.get("/")
+    assert resp.status_code == 200
+    assert "first.jpg" in resp.text
+
+    (Path(main.MEDIA_DIR) / "second.jpg").write_bytes(b"2")
+    resp = client.get("/")
+    assert "second.jpg" in resp.text
+
+
+def test_media_cache_headers(client: TestClient):
+    mount = next(r for r in main.app.routes if getattr(r, "path", None) == "/media")
+    (Path(mount.app.directory) / "pic.jpg").write_bytes(b"img")
+    resp = client.get("/media/pic.jpg")
+    assert resp.status_code == 200
+    assert resp.headers["cache-control"] == main.MEDIA_CACHE_CONTROL
+    resp = client.get("/media/pic.jpg", headers={"If-None-Match": resp.headers["etag"]})
+    assert resp.status_code == 304
+
+
+def test_media_redirect_response():
+    resp = main.media_redirect_response("a b#1.jpg", "/internal-media/")
+    assert resp.headers["x-accel-redirect"] == "/internal-media/a%20b%231.jpg"
+    assert resp.headers["cache-control"] == main.MEDIA_CACHE_CONTROL
+    resp = main.media_redirect_response("pic.jpg", "/internal-media")
+    assert resp.headers["x-accel-redirect"] == "/internal-media/pic.jpg"
+    for name in ("..", ".", "", "sub/pic.jpg"):
+        with pytest.raises(main.HTTPException) as exc:
+            main.media_redirect_response(name, "/internal-media")
+        assert exc.value.status_code == 404
+
+
+def test_elo_updates_follow_pairwise_formula(client: TestClient):
+    files = [f"e{i}.jpg" for i in range(4)]
+    for name in files:
+        (Path(main.MEDIA_DIR) / name).write_bytes(name.encode())
+
+    client.post("/register", data={"username": "u", "password": "p"}, follow_redirects=False)
+    client.post("/login", data={"username": "u", "password": "p"}, follow_redirects=False)
+    client.post("/rate", data={"order": ",".join(files)}, follow_redirects=False)
+    client.post("/rate", data={"order": ",".join(reversed(files[1:]))}, follow_redirects=False)
+
+    expected = {name: 1000.0 for name in files}
+    for order in (files, list(reversed(files[1:]))):
+        for i in range(len(order)):
+            for j in range(i + 1, len(order)):
+                ra, rb = expected[order[i]], expected[order[j]]
+                ea = 1 / (1 + 10 ** ((rb - ra) / 400))
+                eb = 1 / (1 + 10 ** ((ra - rb) / 400))
+                expected[order[i]] = ra + 32 * (1 - ea)
+                expected[order[j]] = rb + 32 * (0 - eb)
+
+    conn = sqlite3.connect(main.DATABASE)
+    cur = conn.cursor()
+    cur.execute("SELECT filename, elo, rating_count FROM media")
+    rows = {name: (elo, cnt) for name, elo, cnt in cur.fetchall()}
+    cur.execute(
+        "SELECT m.filename, um.elo FROM user_media um JOIN media m ON um.media_id=m.id WHERE um.username=?",
+        ("u",),
+    )
+    user_rows = dict(cur.fetchall())
+    conn.close()
+    for name in files:
+        assert rows[name][0] == pytest.approx(expected[name])
+        assert user_rows[name] == pytest.approx(expected[name])
+    assert rows[files[0]][1] == 3
+    assert rows[files[1]][1] == 5
+
+
+def test_stats_cache_survives_deleted_rankings(client: TestClient):
+    files = [f"s{i}.jpg" for i in range(4)]
+    for name in files:
+        (Path(main.MEDIA_DIR) / name).write_bytes(name.encode())
+
+    main.utils.record_ranking("x", files)
+    main.utils.get_elo_rankings(2)
+    main.utils.get_name_group_elo_stats()
+    # the second rater's rankings row is the newest one, and deleting it must
+    # not bring back the version the cache was filled at
+    main.utils.record_ranking("y", [files[3], files[0]])
+    main.utils.delete_user("y")
+
+    conn = sqlite3.connect(main.DATABASE)
+    cur = conn.cursor()
+    cur.execute("SELECT filename, elo, rating_count FROM media ORDER BY elo DESC LIMIT 2")
+    fresh_top = cur.fetchall()
+    cur.execute("SELECT SUM(rating_count) FROM media")
+    fresh_total = cur.fetchone()[0]
+    conn.close()
+    assert main.utils.get_elo_rankings(2) == fresh_top
+    assert sum(g[2] for g in main.utils.get_name_group_elo_stats()) == fresh_total